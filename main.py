@@ -1,12 +1,30 @@
 from fastapi import FastAPI, HTTPException, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, constr
 import uvicorn
+import ahocorasick
 import re
 import json
 import os
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Dict, List, Optional
 
+# Collapses runs of spaces in translated output
+_MULTISPACE_RE = re.compile(r' +')
+
+# Characters dropped when DichLieu is on
+_DICHLIEU_CHARS = frozenset('的了着')
+
+# Longest input kept in the translation result cache; longer texts (whole
+# chapters) are translated directly instead of being pinned in memory
+_CACHE_MAX_TEXT_LEN = 300
+
+# Vietphrase display tables kept at once: every Motnghia/Ngoac combination
+# with one separator. The table for the current defaults is never evicted
+_VP_DISPLAY_LIMIT = 4
+
 class ChineseVietnameseTranslator:
     def __init__(self):
         # Configuration options
@@ -22,9 +40,24 @@ class ChineseVietnameseTranslator:
         self.dict_vp = {}    # Vietphrase dictionary (vietphrase.txt)
         self.dict_names = {} # Names dictionary
         
-        # For sorting
-        self.dict_vp_keys = []
+        # Vietphrase output tokens (leading space, Motnghia/Ngoac applied),
+        # memoized per display key (see vp_display_key) for default options
+        # only, so a request cannot force a dictionary-wide rebuild
+        self.vp_displays = {}
+        
+        # Name keys sorted by replacement priority, and their first characters
         self.dict_names_keys = []
+        self.names_firstchars = frozenset()
+        
+        # Aho-Corasick automatons over vietphrase and name keys; the
+        # vietphrase one only stores key lengths, as plain C integers
+        self.ac_vp = ahocorasick.Automaton(ahocorasick.STORE_LENGTH)
+        self.ac_names = ahocorasick.Automaton()
+        
+        # str.translate tables for single-character pinyin lookups; the
+        # fallback ones are keyed by DichLieu and drop its characters when on
+        self.pa_table = {}
+        self.fallback_tables = {False: {}, True: {}}
         
         # Load dictionaries automatically from current directory
         self.load_default_dictionaries()
@@ -50,27 +83,45 @@ class ChineseVietnameseTranslator:
     def load_dict_from_file(self, file_path, dict_type):
         """Load dictionary from a file"""
         result = {}
+        # Many entries share a value; keep one string object per distinct value
+        canonical = {}
         try:
+            # Read the whole file at once and split it in C
             with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith(('//', '#', '=')):
-                        continue
-                    parts = line.split('=', 1)
-                    if len(parts) != 2:
-                        continue
-                    key, value = parts[0], parts[1].strip()
-                    result[key] = value
+                lines = f.read().split('\n')
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith(('//', '#', '=')):
+                    continue
+                key, sep, value = line.partition('=')
+                if not sep:
+                    continue
+                value = value.strip()
+                result[key] = canonical.setdefault(value, value)
             
             if dict_type == 'vp':
                 self.dict_vp = result
-                # Sort keys by length (descending) then alphabetically
-                self.dict_vp_keys = sorted(self.dict_vp.keys(), key=lambda x: (-len(x), x))
+                # Build automaton so matching walks the text only once
+                self.ac_vp = ahocorasick.Automaton(ahocorasick.STORE_LENGTH)
+                for k in result:
+                    self.ac_vp.add_word(k)
+                self.ac_vp.make_automaton()
+                # Pre-warm the table for the default options
+                self.vp_displays = {}
+                self.get_vp_display(self.options)
             elif dict_type == 'pa':
                 self.dict_pa = result
+                self.pa_table = {ord(k): ' ' + v for k, v in result.items() if len(k) == 1}
+                self.build_fallback_tables()
             elif dict_type == 'names':
                 self.dict_names = result
                 self.dict_names_keys = sorted(self.dict_names.keys(), key=lambda x: (-len(x), x))
+                self.names_firstchars = frozenset(k[0] for k in result)
+                # Rank follows dict_names_keys so longer names keep priority
+                self.ac_names = ahocorasick.Automaton()
+                for rank, k in enumerate(self.dict_names_keys):
+                    self.ac_names.add_word(k, (rank, len(k), ' ' + result[k]))
+                self.ac_names.make_automaton()
             
             print(f"Loaded {len(result)} entries for {dict_type} dictionary from {file_path}")
             return True
@@ -80,96 +131,191 @@ class ChineseVietnameseTranslator:
             
     def trans_pa(self, text):
         """Translate text using pinyin dictionary"""
-        result = ""
-        for c in text:
-            if c in self.dict_pa:
-                result += " " + self.dict_pa[c]
-            else:
-                result += c
-        return result
+        return text.translate(self.pa_table)
+    
+    def build_fallback_tables(self):
+        """Build the tables used for characters not covered by any phrase"""
+        table = dict(self.pa_table)
+        for c in _DICHLIEU_CHARS:
+            table[ord(c)] = None
+        self.fallback_tables = {False: self.pa_table, True: table}
+    
+    def format_vp(self, vp, motnghia, ngoac, daucach):
+        """Format one vietphrase value as an output token"""
+        if motnghia:
+            vp = vp.split(daucach)[0]
+        if ngoac:
+            vp = f"[{vp.strip()}]"
+        return ' ' + vp
     
-    def trans_vp(self, text):
+    def build_vp_display(self, motnghia, ngoac, daucach):
+        """Build vietphrase output tokens for the given options"""
+        display = {}
+        canonical = {}
+        for k, vp in self.dict_vp.items():
+            token = self.format_vp(vp, motnghia, ngoac, daucach)
+            display[k] = canonical.setdefault(token, token)
+        return display
+    
+    def vp_display_key(self, options):
+        """Return the memo key of the display table for the given options"""
+        # daucach is only used to split meanings when Motnghia is on
+        motnghia = options["Motnghia"]
+        return (motnghia, options["Ngoac"], options["daucach"] if motnghia else None)
+    
+    def get_vp_display(self, options):
+        """Return the vietphrase output tokens for the given options
+        
+        Builds the table when missing, so only call this for default
+        options; trans_vp formats per match for anything not memoized.
+        """
+        key = self.vp_display_key(options)
+        display = self.vp_displays.get(key)
+        if display is None:
+            display = self.build_vp_display(*key)
+            # Copy on write so concurrent readers never see the memo change
+            displays = dict(self.vp_displays)
+            if len(displays) >= _VP_DISPLAY_LIMIT:
+                # Evict the oldest table other than the current defaults'
+                default_key = self.vp_display_key(self.options)
+                for old_key in displays:
+                    if old_key != default_key:
+                        del displays[old_key]
+                        break
+            displays[key] = display
+            self.vp_displays = displays
+        return display
+    
+    def replace_names(self, text):
+        """Replace names in text, longest names first"""
+        # Matches are taken from the original text only, so Chinese left in
+        # a name's value (e.g. 初音未来=Hatsune Miku/phải là 未来初音) is no
+        # longer searched for other names; it goes through vietphrase instead
+        matches = sorted(
+            (rank, end_idx - klen + 1, end_idx + 1, value)
+            for end_idx, (rank, klen, value) in self.ac_names.iter(text)
+        )
+        if not matches:
+            return text
+        
+        # Accept non-overlapping matches in priority order, leftmost first
+        taken = bytearray(len(text))
+        accepted = []
+        for rank, start, end, value in matches:
+            if any(taken[start:end]):
+                continue
+            taken[start:end] = b'\x01' * (end - start)
+            accepted.append((start, end, value))
+        accepted.sort()
+        
+        parts = []
+        prev = 0
+        for start, end, value in accepted:
+            parts.append(text[prev:start])
+            parts.append(value)
+            prev = end
+        parts.append(text[prev:])
+        return ''.join(parts)
+    
+    def trans_vp(self, text, options):
         """Translate text using vietphrase dictionary"""
         if not self.dict_vp or not self.dict_pa:
             return text
             
-        result = ""
+        parts = []
+        append = parts.append
         
-        # First replace names if available
-        if self.dict_names and self.dict_names_keys:
-            for name in self.dict_names_keys:
-                text = text.replace(name, ' ' + self.dict_names[name])
+        # First replace names if available; skip the automaton walk when
+        # no character in the text can start a name
+        if self.dict_names and not self.names_firstchars.isdisjoint(text):
+            text = self.replace_names(text)
         
-        # Prepare variables
-        max_length = len(self.dict_vp_keys[0]) if self.dict_vp_keys else 0
-        dichlieu = ['的', '了', '着'] if self.options["DichLieu"] else []
+        # Prepare variables; option sets without a memoized table (per-request
+        # overrides) are formatted per match instead
+        key = self.vp_display_key(options)
+        dict_vp_display = self.vp_displays.get(key)
+        if dict_vp_display is not None:
+            vp_token = dict_vp_display.__getitem__
+        else:
+            dict_vp = self.dict_vp
+            format_vp = self.format_vp
+            vp_token = lambda k: format_vp(dict_vp[k], *key)
+        fallback_table = self.fallback_tables[bool(options["DichLieu"])]
         
-        # Main translation loop
+        # Collect the longest match starting at each position in one pass
+        longest = {}
+        get_longest = longest.get
+        for end_idx, klen in self.ac_vp.iter(text):
+            start = end_idx - klen + 1
+            if klen > get_longest(start, 0):
+                longest[start] = klen
+        
+        # Main translation loop: take matches left to right, translating
+        # the unmatched characters in between in a single call
         i = 0
-        while i < len(text):
-            found_match = False
-            
-            # Try to match the longest phrases first
-            for j in range(max_length, 0, -1):
-                if i + j > len(text):
-                    continue
-                    
-                substr = text[i:i+j]
-                
-                if substr in self.dict_vp:
-                    vp = self.dict_vp[substr]
-                    
-                    # Process the translation according to options
-                    if self.options["Motnghia"]:
-                        vp = vp.split(self.options["daucach"])[0]
-                    
-                    if self.options["Ngoac"]:
-                        vp = f"[{vp.strip()}]"
-                        
-                    result += ' ' + vp
-                    i += j
-                    found_match = True
-                    break
-            
-            # If no match found, process single character
-            if not found_match:
-                if i < len(text):
-                    char = text[i]
-                    
-                    # Skip special characters if configured
-                    if char in dichlieu:
-                        i += 1
-                        continue
-                        
-                    # Use pinyin or original character
-                    if char in self.dict_pa:
-                        result += ' ' + self.dict_pa[char]
-                    else:
-                        result += char
-                    
-                    i += 1
-                else:
-                    # Avoid infinite loop
-                    break
+        for start in sorted(longest):
+            if start < i:
+                continue
+            if start > i:
+                append(text[i:start].translate(fallback_table))
+            i = start + longest[start]
+            append(vp_token(text[start:i]))
+        append(text[i:].translate(fallback_table))
                 
         # Clean up multiple spaces
-        return re.sub(r' +', ' ', result).strip()
+        return _MULTISPACE_RE.sub(' ', ''.join(parts)).strip()
     
-    def translate(self, text):
-        """Main translation function"""
-        return self.trans_vp(text)
+    def translate(self, text, options=None):
+        """Main translation function
+        
+        Only the given options are read, so concurrent calls with different
+        options do not interfere. Defaults to a snapshot of the current options.
+        """
+        if options is None:
+            options = self.get_options()
+        return self.trans_vp(text, options)
+    
+    def is_valid_option(self, name, value):
+        """Check that value can be used for the named option"""
+        if name not in self.options:
+            return False
+        if name == "daucach":
+            # str.split needs a non-empty separator
+            return isinstance(value, str) and value != ''
+        return isinstance(value, bool)
     
     def set_option(self, name, value):
         """Set translation option"""
-        if name in self.options:
-            self.options[name] = value
-            return True
-        return False
+        if not self.is_valid_option(name, value):
+            print(f"Rejected option {name}={value!r}")
+            return False
+        # Pre-warm the display table for the new defaults
+        if name in ("Motnghia", "Ngoac", "daucach"):
+            new_options = self.get_options()
+            new_options[name] = value
+            self.get_vp_display(new_options)
+        self.options[name] = value
+        return True
     
     def get_options(self):
         """Get current options"""
         return self.options.copy()
     
+    def resolve_options(self, overrides=None):
+        """Get current options with per-request overrides applied
+        
+        Unknown option names are ignored; a known option with an unusable
+        value raises ValueError.
+        """
+        options = self.get_options()
+        if overrides:
+            for name, value in overrides.items():
+                if name in options:
+                    if not self.is_valid_option(name, value):
+                        raise ValueError(f"Invalid value for option {name}: {value!r}")
+                    options[name] = value
+        return options
+    
     def get_dictionary_status(self):
         """Get status of loaded dictionaries"""
         return {
@@ -179,26 +325,71 @@ class ChineseVietnameseTranslator:
         }
 
 # FastAPI Models
+class TranslationOptions(BaseModel):
+    # Each option is parsed with its own type, so "true"/"false" still work
+    # for the flags; unknown names are kept for the caller to ignore or reject
+    model_config = ConfigDict(extra='allow')
+    
+    Ngoac: Optional[bool] = None
+    Motnghia: Optional[bool] = None
+    daucach: Optional[constr(min_length=1)] = None
+    DichLieu: Optional[bool] = None
+
 class TranslationRequest(BaseModel):
     text: str
-    options: Optional[Dict[str, bool]] = None
+    options: Optional[TranslationOptions] = None
 
 class TranslationResponse(BaseModel):
     translated_text: str
     options_used: Dict
 
 class OptionsRequest(BaseModel):
-    options: Dict[str, bool]
+    options: TranslationOptions
 
 class OptionsResponse(BaseModel):
     options: Dict
     success: bool
 
+class DictionaryStatus(BaseModel):
+    pinyin_dictionary: str
+    vietphrase_dictionary: str
+    names_dictionary: str
+
+class RootResponse(BaseModel):
+    message: str
+    dictionaries: DictionaryStatus
+
+class StatusResponse(BaseModel):
+    dictionaries: DictionaryStatus
+    options: Dict
+
+# The translator is built on first use instead of at import time, so the
+# uvicorn supervisor and the spawn re-import of this script (__mp_main__)
+# never load dictionaries; only the app that actually serves does
+_translator = None
+_translator_lock = threading.Lock()
+
+def get_translator():
+    """Get the shared translator, building it on first use"""
+    global _translator
+    if _translator is None:
+        with _translator_lock:
+            if _translator is None:
+                _translator = ChineseVietnameseTranslator()
+    return _translator
+
+@asynccontextmanager
+async def lifespan(app):
+    """Load dictionaries once per worker, before it starts serving"""
+    get_translator()
+    yield
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Chinese-Vietnamese Translator API",
     description="API for translating Chinese text to Vietnamese using pinyin and vietphrase dictionaries",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware to allow cross-origin requests
@@ -210,13 +401,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize translator as a global instance
-translator = ChineseVietnameseTranslator()
+@lru_cache(maxsize=4096)
+def _translate_cached(text, opts_tuple):
+    """Translate text, memoized per input and option set"""
+    return get_translator().translate(text, dict(opts_tuple))
+
+def translate_cached(text, options):
+    """Translate text with the given options, reusing cached results"""
+    if len(text) > _CACHE_MAX_TEXT_LEN:
+        return get_translator().translate(text, options)
+    return _translate_cached(text, tuple(sorted(options.items())))
 
 # API Routes
-@app.get("/")
+@app.get("/", response_model=RootResponse)
 async def root():
     """Root endpoint showing API status and dictionary info"""
+    translator = get_translator()
     dict_status = translator.get_dictionary_status()
     return {
         "message": "Chinese-Vietnamese Translator API is running",
@@ -228,40 +428,45 @@ async def root():
     }
 
 @app.post("/translate", response_model=TranslationResponse)
-async def translate_text(request: TranslationRequest):
+def translate_text(request: TranslationRequest):
     """
     Translate Chinese text to Vietnamese
     
     - **text**: Chinese text to translate
     - **options**: Optional translation options
     """
-    # Update options if provided
-    if request.options:
-        for key, value in request.options.items():
-            translator.set_option(key, value)
+    translator = get_translator()
+    # Per-request options apply to this call only
+    try:
+        overrides = request.options.model_dump(exclude_none=True) if request.options else None
+        options = translator.resolve_options(overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Translate text
     try:
-        translated_text = translator.translate(request.text)
+        translated_text = translate_cached(request.text, options)
         return {
             "translated_text": translated_text,
-            "options_used": translator.get_options()
+            "options_used": options
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Translation error: {str(e)}")
 
 @app.get("/translate", response_model=TranslationResponse)
-async def translate_text_get(text: str = Query(..., description="Chinese text to translate")):
+def translate_text_get(text: str = Query(..., description="Chinese text to translate")):
     """
     Translate Chinese text to Vietnamese using GET method
     
     - **text**: Chinese text to translate
     """
+    translator = get_translator()
+    options = translator.get_options()
     try:
-        translated_text = translator.translate(text)
+        translated_text = translate_cached(text, options)
         return {
             "translated_text": translated_text,
-            "options_used": translator.get_options()
+            "options_used": options
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Translation error: {str(e)}")
@@ -269,20 +474,24 @@ async def translate_text_get(text: str = Query(..., description="Chinese text to
 @app.get("/options", response_model=OptionsResponse)
 async def get_options():
     """Get current translation options"""
+    translator = get_translator()
     return {
         "options": translator.get_options(),
         "success": True
     }
 
 @app.post("/options", response_model=OptionsResponse)
-async def set_options(request: OptionsRequest):
+def set_options(request: OptionsRequest):
     """
     Set translation options
     
     - **options**: Dictionary of options to set
     """
+    # Plain def: set_option may build a display table, which must not
+    # run on the event loop
+    translator = get_translator()
     success = True
-    for key, value in request.options.items():
+    for key, value in request.options.model_dump(exclude_none=True).items():
         if not translator.set_option(key, value):
             success = False
     
@@ -291,9 +500,10 @@ async def set_options(request: OptionsRequest):
         "success": success
     }
 
-@app.get("/status")
+@app.get("/status", response_model=StatusResponse)
 async def get_status():
     """Get status of loaded dictionaries and options"""
+    translator = get_translator()
     dict_status = translator.get_dictionary_status()
     return {
         "dictionaries": {
@@ -304,7 +514,7 @@ async def get_status():
         "options": translator.get_options()
     }
 @app.get("/translate_a/single", response_model=list)
-async def translate_for_apk_compatibility(
+def translate_for_apk_compatibility(
     q: str = Query(..., description="Chinese text to translate (Google-compatible)"),
     # Các tham số sau đây được app gửi lên nhưng API của bạn không dùng,
     # chúng ta khai báo để FastAPI nhận và bỏ qua chúng một cách hợp lệ.
@@ -318,9 +528,10 @@ async def translate_for_apk_compatibility(
     - Nhận tham số 'q'
     - Trả về cấu trúc JSON dạng [[["dịch", "gốc"]]]
     """
+    translator = get_translator()
     try:
         # Dùng chính bộ dịch của bạn để dịch văn bản từ tham số 'q'
-        translated_text = translator.translate(q)
+        translated_text = translate_cached(q, translator.get_options())
         
         # Tạo cấu trúc response y hệt API của Google/moldich
         google_style_response = [
@@ -341,7 +552,15 @@ async def translate_for_apk_compatibility(
         raise HTTPException(status_code=500, detail=f"Translation error: {str(e)}")
 def main():
     """Run the FastAPI application with uvicorn"""
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if os.getenv("ENV", "dev") == "prod":
+        # Production: one process per core, no file-watcher reloader.
+        # Each worker loads the dictionaries once in the app's lifespan;
+        # uvicorn picks uvloop/httptools automatically when installed.
+        workers = int(os.getenv("WORKERS", os.cpu_count() or 1))
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers,
+                    reload=False, access_log=False)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 if __name__ == "__main__":
     # This is for running the app directly